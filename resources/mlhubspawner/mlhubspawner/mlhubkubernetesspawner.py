@@ -41,7 +41,7 @@ class MLHubKubernetesSpawner(KubeSpawner):
         """Return the spawner options screen"""
 
         # Only show spawner options for named servers (the default server should start with default values)
-        if getattr(self, "name", "") == "":
+        if not self.name:
             return ''
 
         return spawner_options.get_options_form(self)
@@ -54,14 +54,17 @@ class MLHubKubernetesSpawner(KubeSpawner):
     def get_env(self):
         env = super().get_env()
         
-        if self.user_options.get('env'):
-            env.update(self.user_options.get('env'))
+        user_options = self.user_options
+        user_env = user_options.get('env')
+        if user_env:
+            env.update(user_env)
 
         #if self.user_options.get('gpus'):
         #    env['NVIDIA_VISIBLE_DEVICES'] = self.user_options.get('gpus')
 
-        if self.user_options.get('cpu_limit'):
-            env["MAX_NUM_THREADS"] = self.user_options.get('cpu_limit')
+        cpu_limit = user_options.get('cpu_limit')
+        if cpu_limit:
+            env["MAX_NUM_THREADS"] = cpu_limit
 
         env['SSH_JUMPHOST_TARGET'] = self.pod_name
 
@@ -71,21 +74,25 @@ class MLHubKubernetesSpawner(KubeSpawner):
     def start(self):
         """Set custom configuration during start before calling the super.start method of Dockerspawner"""
 
-        self.saved_user_options = self.user_options
+        user_options = self.user_options
+        self.saved_user_options = user_options
 
-        if self.user_options.get('image'):
-            self.image = self.user_options.get('image')
+        image = user_options.get('image')
+        if image:
+            self.image = image
 
         # Set request explicitly to 0, otherwise Kubernetes will set it to the same amount as limit
         # self.cpu_guarantee / self.mem_guarantee cannot be directly used, as they are of type ByteSpecification and, for example, 0G will be transformed to 0 which will not pass
         # the 'if cpu_guarantee' check (see https://github.com/jupyterhub/kubespawner/blob/8a6d66e04768565c0fc56c790a5fc42bfee634ec/kubespawner/objects.py#L279).
         # Hence, set it via extra_resource_guarantees.
         self.extra_resource_guarantees = {"cpu": 0, "memory": "0G"}
-        if self.user_options.get('cpu_limit'):
-            self.cpu_limit = float(self.user_options.get('cpu_limit'))
+        cpu_limit = user_options.get('cpu_limit')
+        if cpu_limit:
+            self.cpu_limit = float(cpu_limit)
 
-        if self.user_options.get('mem_limit'):
-            memory = str(self.user_options.get('mem_limit')) + "G"
+        mem_limit = user_options.get('mem_limit')
+        if mem_limit:
+            memory = str(mem_limit) + "G"
             self.mem_limit = memory.upper().replace("GB", "G").replace("KB", "K").replace("MB", "M").replace("TB", "T")
 
         #if self.user_options.get('is_mount_volume') == 'on':
@@ -94,8 +101,9 @@ class MLHubKubernetesSpawner(KubeSpawner):
 
         # set default label 'origin' to know for sure which containers where started via the hub
         #self.extra_labels['pod_name'] = self.pod_name
-        if self.user_options.get('days_to_live'):
-            days_to_live_in_seconds = int(self.user_options.get('days_to_live')) * 24 * 60 * 60 # days * hours_per_day * minutes_per_hour * seconds_per_minute
+        days_to_live = user_options.get('days_to_live')
+        if days_to_live:
+            days_to_live_in_seconds = int(days_to_live) * 24 * 60 * 60 # days * hours_per_day * minutes_per_hour * seconds_per_minute
             expiration_timestamp = time.time() + days_to_live_in_seconds
             self.extra_labels[utils.LABEL_EXPIRATION_TIMESTAMP] =  str(expiration_timestamp)
         else:
@@ -131,7 +139,7 @@ class MLHubKubernetesSpawner(KubeSpawner):
             )
         except client.rest.ApiException as e:
             if e.status == 409:
-                self.log.info('Service {} already existed. No need to re-create.'.format(self.pod_name))
+                self.log.info('Service %s already existed. No need to re-create.', self.pod_name)
 
         return res
     
@@ -149,7 +157,7 @@ class MLHubKubernetesSpawner(KubeSpawner):
                 body=delete_options
             )
         except:
-            self.log.warn("Could not delete service with name {}".format(self.pod_name))
+            self.log.warn("Could not delete service with name %s", self.pod_name)
 
     
     def get_container_metadata(self) -> str:
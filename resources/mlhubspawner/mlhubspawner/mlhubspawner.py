@@ -8,16 +8,17 @@ It extends the DockerSpawner with following features:
 from dockerspawner import DockerSpawner
 
 import docker
-import docker.types
 import docker.errors
-from docker.utils import kwargs_from_env
 
-import os
 import subprocess
 import socket
+import struct
 import ipaddress
-from traitlets import default, Unicode, List
+import threading
+from functools import partial
+from traitlets import default, Unicode, List, Bool
 from tornado import gen
+from tornado.ioloop import IOLoop
 import psutil
 import time
 import re
@@ -28,7 +29,19 @@ from mlhubspawner import spawner_options, utils
 # Docker by default uses the range 172.17-32.0.0, so we should be save using that range
 INITIAL_CIDR_FIRST_OCTET = 172
 INITIAL_CIDR_SECOND_OCTET = 33
-INITIAL_CIDR = "{}.33.0.0/24".format(INITIAL_CIDR_FIRST_OCTET)
+# network address of the initial subnet 172.33.0.0/24 as integer
+INITIAL_SUBNET_ADDRESS = (INITIAL_CIDR_FIRST_OCTET << 24) | (INITIAL_CIDR_SECOND_OCTET << 16)
+
+# Extracts the hostname of the JupyterHub URLs passed to the workspaces
+HUB_URL_HOSTNAME_REGEX = re.compile("http(s)?://([a-zA-Z0-9]+):[0-9]{3,5}.*")
+
+# Templates for the IPAM configuration of created networks; equal to what docker.types.IPAMConfig / IPAMPool create, but without
+# instantiating (and validating) the wrapper classes for every network
+IPAM_CONFIG_TEMPLATE = {"Driver": "default"}
+IPAM_POOL_TEMPLATE = {"IPRange": None, "AuxiliaryAddresses": None}
+
+# how often the creation of a network is tried with the next free subnet before giving up
+NETWORK_CREATION_ATTEMPTS = 5
 
 def has_complete_network_information(network):
     """Convenient function to check whether the docker.Network object has all required properties.
@@ -37,11 +50,46 @@ def has_complete_network_information(network):
         network (docker.Network)
 
     Returns:
-        bool: True if it has all properties, False otehrwise.
+        bool: True if it has all properties, False otherwise.
     """
-    return network.attrs["IPAM"] and network.attrs["IPAM"]["Config"] \
-        and len(network.attrs["IPAM"]["Config"]) > 0 \
-        and network.attrs["IPAM"]["Config"][0]["Subnet"]
+    config = (network.attrs.get("IPAM") or {}).get("Config") or []
+    return bool(config) and bool(config[0].get("Subnet"))
+
+def subnet_to_int(subnet):
+    """Convert the network address of a subnet string (e.g. '172.33.1.0/24') into an integer.
+
+    Args:
+        subnet (str)
+
+    Returns:
+        int: the network address as unsigned 32 bit integer
+    """
+
+    return struct.unpack('>I', socket.inet_aton(subnet.split('/', 1)[0]))[0]
+
+def get_highest_subnet_address(networks):
+    """Determine the highest subnet of the given networks within the MLHub range.
+    E.g. when you have three subnets 172.33.1.0, 172.33.2.0, and 172.33.3.0, the highest subnet will be 172.33.3.0
+    The addresses are compared as plain integers instead of ipaddress objects, as this is called for every existing network.
+
+    Args:
+        networks (list): list of docker.Network objects
+
+    Returns:
+        int: the network address of the highest subnet or of the initial subnet if no network is in the range
+    """
+
+    highest_address = INITIAL_SUBNET_ADDRESS
+    for network in networks:
+        if (has_complete_network_information(network)):
+            address = subnet_to_int(network.attrs["IPAM"]["Config"][0]["Subnet"])
+
+            if (address >> 24) == INITIAL_CIDR_FIRST_OCTET \
+                    and ((address >> 16) & 0xff) >= INITIAL_CIDR_SECOND_OCTET:
+                if address > highest_address:
+                    highest_address = address
+
+    return highest_address
 
 
 class MLHubDockerSpawner(DockerSpawner):
@@ -49,6 +97,16 @@ class MLHubDockerSpawner(DockerSpawner):
 
     #hub_name = Unicode(config=True, help="Name of the hub container.")
 
+    # Network address (as integer) of the highest subnet that was handed out to a workspace network so far. It is shared between all
+    # spawner instances so that the existing Docker networks only have to be scanned once instead of on every network creation.
+    # It only grows for the lifetime of the hub process, so subnets of removed networks are only reused after a restart of the hub.
+    _highest_subnet_address = None
+    _cidr_lock = threading.Lock()
+
+    _resource_information = None
+
+    _highlevel_docker_client = None
+
     workspace_images = List(
         trait = Unicode(),
         default_value = [],
@@ -56,10 +114,20 @@ class MLHubDockerSpawner(DockerSpawner):
         help = "Pre-defined workspace images"
     )
 
+    use_docker_address_pools = Bool(
+        default_value = False,
+        config = True,
+        help = """Let the Docker daemon allocate the subnets of the workspace networks instead of determining them in the spawner.
+        Requires `default-address-pools` to be configured in the daemon.json of the Docker daemon,
+        e.g. {"default-address-pools": [{"base": "172.33.0.0/16", "size": 24}]}"""
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.hub_name = utils.ENV_HUB_NAME
         self.default_labels = {utils.LABEL_MLHUB_ORIGIN: self.hub_name, utils.LABEL_MLHUB_USER: self.user.name, utils.LABEL_MLHUB_SERVER_NAME: self.name}
+        # Network resolved in start, so that create_object does not have to look it up again
+        self.workspace_network = None
         # Get the MLHub container name to be used as the DNS name for the spawned workspaces, so they can connect to the Hub even if the container is
         # removed and restarted
         client = self.highlevel_docker_client
@@ -73,21 +141,41 @@ class MLHubDockerSpawner(DockerSpawner):
             pass
 
         # Get available resource information
-        self.resource_information = {
-            "cpu_count": psutil.cpu_count(),
-            "memory_count_in_gb": round(psutil.virtual_memory().total/1024/1024/1024, 1),
-            "gpu_count": self.get_gpu_info()
-        }
+        self.resource_information = self.get_resource_information()
+
+    def get_resource_information(self) -> dict:
+        """Get the available resources of the host. They do not change during the lifetime of the hub process, so they are only
+        determined once (instead of calling psutil and nvidia-smi for every spawner instance) and shared between all spawners.
+
+        Returns:
+            dict: cpu count, memory in GB, and gpu count of the host
+        """
+
+        cls = MLHubDockerSpawner
+        if cls._resource_information is None:
+            cls._resource_information = {
+                "cpu_count": psutil.cpu_count(),
+                "memory_count_in_gb": round(psutil.virtual_memory().total/1024/1024/1024, 1),
+                "gpu_count": self.get_gpu_info()
+            }
+
+        return cls._resource_information
     
     @property
     def highlevel_docker_client(self):
         """Create a highlevel docker client as 'self.client' is the low-level API client.
+        Like 'self.client' of DockerSpawner, the client is only created once and shared between all spawners, as its configuration
+        does not change for a running hub (and creating it negotiates the API version with the Docker daemon).
 
         Returns:
             docker.DockerClient
         """
         
-        return utils.init_docker_client(self.client_kwargs, self.tls_config)
+        cls = MLHubDockerSpawner
+        if cls._highlevel_docker_client is None:
+            cls._highlevel_docker_client = utils.init_docker_client(self.client_kwargs, self.tls_config)
+
+        return cls._highlevel_docker_client
 
     @property
     def network_name(self):
@@ -102,7 +190,7 @@ class MLHubDockerSpawner(DockerSpawner):
         """Return the spawner options screen"""
 
         # Only show spawner options for named servers (the default server should start with default values)
-        if getattr(self, "name", "") == "":
+        if not self.name:
             return ''
 
         return spawner_options.get_options_form_docker(self)
@@ -118,24 +206,27 @@ class MLHubDockerSpawner(DockerSpawner):
 
         # Replace JupyterHub container id with the name for spawned workspaces, so that the workspaces can connect to the hub even if the hub was removed and recreated.
         # Otherwise, the workspaces would have the old container id that does not exist anymore in such a case.
-        hostname_regex = re.compile("http(s)?://([a-zA-Z0-9]+):[0-9]{3,5}.*")
         jupyterhub_api_url = env.get('JUPYTERHUB_API_URL')
         if jupyterhub_api_url:
-            hostname = hostname_regex.match(jupyterhub_api_url).group(2)
+            hostname = HUB_URL_HOSTNAME_REGEX.match(jupyterhub_api_url).group(2)
             env['JUPYTERHUB_API_URL'] = jupyterhub_api_url.replace(hostname, self.hub_name)
         jupyterhub_activity_url = env.get('JUPYTERHUB_ACTIVITY_URL')
         if jupyterhub_activity_url:
-            hostname = hostname_regex.match(jupyterhub_activity_url).group(2)
+            hostname = HUB_URL_HOSTNAME_REGEX.match(jupyterhub_activity_url).group(2)
             env['JUPYTERHUB_ACTIVITY_URL'] = jupyterhub_activity_url.replace(hostname, self.hub_name)
         
-        if self.user_options.get('env'):
-            env.update(self.user_options.get('env'))
+        user_options = self.user_options
+        user_env = user_options.get('env')
+        if user_env:
+            env.update(user_env)
 
-        if self.user_options.get('gpus'):
-            env['NVIDIA_VISIBLE_DEVICES'] = self.user_options.get('gpus')
+        gpus = user_options.get('gpus')
+        if gpus:
+            env['NVIDIA_VISIBLE_DEVICES'] = gpus
 
-        if self.user_options.get('cpu_limit'):
-            env["MAX_NUM_THREADS"] = self.user_options.get('cpu_limit')
+        cpu_limit = user_options.get('cpu_limit')
+        if cpu_limit:
+            env["MAX_NUM_THREADS"] = cpu_limit
 
         env['SSH_JUMPHOST_TARGET'] = self.object_name
 
@@ -149,26 +240,28 @@ class MLHubDockerSpawner(DockerSpawner):
             (str, int): container's ip address or '127.0.0.1', container's port
         """
 
-        self.saved_user_options = self.user_options
+        user_options = self.user_options
+        self.saved_user_options = user_options
 
-        if self.user_options.get('image'):
-            self.image = self.user_options.get('image')
+        image = user_options.get('image')
+        if image:
+            self.image = image
 
         extra_host_config = {}
-        if self.user_options.get('cpu_limit'):
+        cpu_limit = user_options.get('cpu_limit')
+        if cpu_limit:
             # nano_cpus cannot be bigger than the number of CPUs of the machine (this method would currently not work in a cluster, as machines could be different than the machine where the runtime-manager and this code run.
             max_available_cpus = self.resource_information["cpu_count"]
-            limited_cpus = min(
-                int(self.user_options.get('cpu_limit')), max_available_cpus)
+            limited_cpus = min(int(cpu_limit), max_available_cpus)
 
             # the nano_cpu parameter of the Docker client expects an integer, not a float
             nano_cpus = int(limited_cpus * 1e9)
             extra_host_config['nano_cpus'] = nano_cpus
-        if self.user_options.get('mem_limit'):
-            extra_host_config['mem_limit'] = str(self.user_options.get(
-                'mem_limit')) + "gb"
+        mem_limit = user_options.get('mem_limit')
+        if mem_limit:
+            extra_host_config['mem_limit'] = str(mem_limit) + "gb"
 
-        if self.user_options.get('is_mount_volume') == 'on':
+        if user_options.get('is_mount_volume') == 'on':
             # {username} and {servername} will be automatically replaced by DockerSpawner with the right values as in template_namespace
             #volumeName = self.name_template.format(prefix=self.prefix)
             self.highlevel_docker_client.volumes.create(name=self.object_name, labels=self.default_labels)
@@ -177,50 +270,64 @@ class MLHubDockerSpawner(DockerSpawner):
         extra_create_kwargs = {}
         # set default label 'origin' to know for sure which containers where started via the hub
         extra_create_kwargs['labels'] = self.default_labels
-        if self.user_options.get('days_to_live'):
-            days_to_live_in_seconds = int(self.user_options.get('days_to_live')) * 24 * 60 * 60 # days * hours_per_day * minutes_per_hour * seconds_per_minute
+        days_to_live = user_options.get('days_to_live')
+        if days_to_live:
+            days_to_live_in_seconds = int(days_to_live) * 24 * 60 * 60 # days * hours_per_day * minutes_per_hour * seconds_per_minute
             expiration_timestamp = time.time() + days_to_live_in_seconds
             extra_create_kwargs['labels'][utils.LABEL_EXPIRATION_TIMESTAMP] =  str(expiration_timestamp)
         else:
             extra_create_kwargs['labels'][utils.LABEL_EXPIRATION_TIMESTAMP] = str(0)
 
-        if self.user_options.get('gpus'):
+        gpus = user_options.get('gpus')
+        if gpus:
             extra_host_config['runtime'] = "nvidia"
-            extra_create_kwargs['labels'][utils.LABEL_NVIDIA_VISIBLE_DEVICES] = self.user_options.get('gpus')
+            extra_create_kwargs['labels'][utils.LABEL_NVIDIA_VISIBLE_DEVICES] = gpus
 
         self.extra_host_config.update(extra_host_config)
         self.extra_create_kwargs.update(extra_create_kwargs)
 
         # Check whether the network still exists to which the container will try to connect
+        client = self.highlevel_docker_client
+        network = None
+        connect_hub_future = None
         try:
-            self.highlevel_docker_client.networks.get(self.network_name)
+            network = yield self.asynchronize(client.networks.get, self.network_name)
         except docker.errors.NotFound:
-            created_network = self.create_network(self.network_name)
-            self.connect_hub_to_network(created_network)
+            # the lookup was just done, so create the network directly instead of via create_network
+            network = yield self.create_new_network(client, self.network_name)
         except docker.errors.APIError:
-            self.log.error("Could not look up network {network_name}".format(network_name=self.network_name))
+            self.log.error("Could not look up network %s", self.network_name)
+        self.workspace_network = network
+
+        # Connect the hub to the network while the workspace container is started (see below). Existing networks the hub is already part of
+        # (according to the lookup above) are skipped, so that the common restart path does not issue a connect request that fails with 403.
+        if network is not None and not self.is_hub_connected(network):
+            connect_hub_future = self.asynchronize(self.connect_hub_to_network, network)
 
         # Delete existing container when it is created via the options_form UI (to make sure that not an existing container is re-used when you actually want to create a new one)
         # reset the flag afterwards to prevent the container from being removed when just stopped
         # Also make it deletable via the user_options (can be set via the POST API)
         if ((hasattr(self, 'new_creating') and self.new_creating == True) 
-            or self.user_options.get("update", False)):
+            or user_options.get("update", False)):
             self.remove = True
-        res = yield super().start()
+        if connect_hub_future is None:
+            res = yield super().start()
+        else:
+            res, _ = yield [super().start(), connect_hub_future]
         self.remove = False
         self.new_creating = False
         return res
 
     @gen.coroutine
     def create_object(self):
-        created_network = None
         try:
-            created_network = self.create_network(self.network_name)
-            self.connect_hub_to_network(created_network)
-        except:
+            # If start already resolved the network, the hub is connected to it in parallel to the container creation
+            if self.workspace_network is None:
+                self.workspace_network = yield self.create_network(self.network_name)
+                yield self.asynchronize(self.connect_hub_to_network, self.workspace_network)
+        except (docker.errors.APIError, ValueError):
             self.log.error(
-                "Could not create the network {network_name} and, thus, cannot create the container."
-                    .format(network_name=self.network_name)
+                "Could not create the network %s and, thus, cannot create the container.", self.network_name
             )
             return
         
@@ -231,7 +338,7 @@ class MLHubDockerSpawner(DockerSpawner):
     def remove_object(self):
         yield super().remove_object()
 
-
+    @gen.coroutine
     def create_network(self, name):
         """Create a new network to put the new container into it. 
         Containers are separated by networks to prevent them from seeing each other.
@@ -249,38 +356,142 @@ class MLHubDockerSpawner(DockerSpawner):
         """
 
         client = self.highlevel_docker_client
-        networks = client.networks.list()
-        highest_cidr = ipaddress.ip_network(INITIAL_CIDR)
-
-        # determine subnet for the network to be created by finding the highest subnet so far.
-        # E.g. when you have three subnets 172.33.1.0, 172.33.2.0, and 172.33.3.0, highest_cidr will be 172.33.3.0
-        for network in networks:
-            if network.name.lower() == name.lower():
-                self.log.info("Network {} already exists".format(name))
+
+        try:
+            network = yield self.asynchronize(client.networks.get, name)
+            self.log.info("Network %s already exists", name)
+            return network
+        except docker.errors.NotFound:
+            pass
+
+        network = yield self.create_new_network(client, name)
+        return network
+
+    @gen.coroutine
+    def create_new_network(self, client, name):
+        """Create the network without checking whether it already exists (see create_network).
+
+        Args:
+            client (docker.DockerClient)
+            name (str): name of the network to be created
+
+        Returns:
+            docker.Network: the newly created network or the network with the given name that was created concurrently
+        """
+
+        if self.use_docker_address_pools:
+            try:
+                self.log.info("Create network %s with a subnet of the Docker address pools", name)
+                network = yield self.asynchronize(client.networks.create, name, labels=self.default_labels, check_duplicate=True)
+            except docker.errors.APIError as e:
+                if e.status_code != 409:
+                    raise
+                # The network was created in the meantime by a concurrent spawn of the same user
+                network = yield self.asynchronize(client.networks.get, name)
+            return network
+
+        if MLHubDockerSpawner._highest_subnet_address is None:
+            yield self.asynchronize(self.sync_highest_cidr, client)
+
+        # Reserving the subnet is atomic, so concurrent spawns never try to use the same subnet
+        for attempt in range(NETWORK_CREATION_ATTEMPTS):
+            next_cidr = self.reserve_next_cidr()
+            try:
+                network = yield self.asynchronize(self.create_network_with_subnet, client, name, next_cidr)
                 return network
+            except docker.errors.APIError as e:
+                if e.status_code == 409:
+                    # The network was created in the meantime by a concurrent spawn of the same user, so the reserved subnet is not needed
+                    self.release_cidr(next_cidr)
+                    network = yield self.asynchronize(client.networks.get, name)
+                    return network
+
+                if attempt == NETWORK_CREATION_ATTEMPTS - 1:
+                    raise
+
+                # The subnet is probably already used by a network that was not created by this hub process (e.g. by a previous hub container),
+                # so sync the cached subnet state with Docker and try again
+                yield self.asynchronize(self.sync_highest_cidr, client)
+
+    def sync_highest_cidr(self, client):
+        """Scan the existing MLHub Docker networks and update the cached highest subnet accordingly.
+
+        Args:
+            client (docker.DockerClient)
+        """
+
+        # Only networks created by an MLHub carry the origin label, so the other networks on the host are not even transferred.
+        # Foreign networks that overlap with the MLHub range are handled by the retry in create_network.
+        networks = client.networks.list(filters={"label": utils.LABEL_MLHUB_ORIGIN})
+        highest_address = get_highest_subnet_address(networks)
+        with MLHubDockerSpawner._cidr_lock:
+            # never go back below subnets that were already reserved by this process
+            if MLHubDockerSpawner._highest_subnet_address is None or highest_address > MLHubDockerSpawner._highest_subnet_address:
+                MLHubDockerSpawner._highest_subnet_address = highest_address
+
+    def reserve_next_cidr(self):
+        """Reserve the next free /24 subnet in the range of 172.33-255.0.0 by incrementing the cached highest subnet.
+        The cache has to be filled via `sync_highest_cidr` before.
+
+        Returns:
+            ipaddress.IPv4Network: the reserved subnet
+
+        Raises:
+            ValueError: if all subnets of the range are used
+        """
+
+        with MLHubDockerSpawner._cidr_lock:
+            # take the highest subnet and add 256 bits, so that if the highest subnet was 172.33.2.0, the new subnet is 172.33.3.0
+            next_address = MLHubDockerSpawner._highest_subnet_address + 256
+            if (next_address >> 24) > INITIAL_CIDR_FIRST_OCTET:
+                raise ValueError("No more possible subnet addresses exist")
+
+            MLHubDockerSpawner._highest_subnet_address = next_address
 
-            if (has_complete_network_information(network)):
-                cidr = ipaddress.ip_network(
-                    network.attrs["IPAM"]["Config"][0]["Subnet"])
-
-                if cidr.network_address.packed[0] == INITIAL_CIDR_FIRST_OCTET \
-                        and cidr.network_address.packed[1] >= INITIAL_CIDR_SECOND_OCTET:
-                    if cidr > highest_cidr:
-                        highest_cidr = cidr
-
-        # take the highest cidr and add 256 bits, so that if the highest subnet was 172.33.2.0, the new subnet is 172.33.3.0
-        next_cidr = ipaddress.ip_network(
-            (highest_cidr.network_address + 256).exploded + "/24")
-        if next_cidr.network_address.packed[0] > INITIAL_CIDR_FIRST_OCTET:
-            raise Exception("No more possible subnet addresses exist")
-
-        self.log.info("Create network {} with subnet {}".format(
-            name, next_cidr.exploded))
-        ipam_pool = docker.types.IPAMPool(subnet=next_cidr.exploded,
-                                          gateway=(next_cidr.network_address + 1).exploded)
-        ipam_config = docker.types.IPAMConfig(pool_configs=[ipam_pool])
-        return client.networks.create(name, ipam=ipam_config, labels=self.default_labels)
+        return ipaddress.ip_network((next_address, 24))
+
+    def release_cidr(self, cidr):
+        """Give back a subnet reserved via `reserve_next_cidr` that was not used for a network.
+        This is only possible if no other subnet was reserved after it, as the cache only stores the highest subnet.
+
+        Args:
+            cidr (ipaddress.IPv4Network): the reserved subnet
+        """
+
+        with MLHubDockerSpawner._cidr_lock:
+            if MLHubDockerSpawner._highest_subnet_address == int(cidr.network_address):
+                MLHubDockerSpawner._highest_subnet_address -= 256
+
+    def create_network_with_subnet(self, client, name, cidr):
+        self.log.info("Create network %s with subnet %s", name, cidr)
+        ipam_pool = {**IPAM_POOL_TEMPLATE, "Subnet": cidr.exploded, "Gateway": (cidr.network_address + 1).exploded}
+        ipam_config = {**IPAM_CONFIG_TEMPLATE, "Config": [ipam_pool]}
+        # check_duplicate makes Docker reject a second network with the same name (409) instead of creating it
+        return client.networks.create(name, ipam=ipam_config, labels=self.default_labels, check_duplicate=True)
     
+    def asynchronize(self, method, *args, **kwargs):
+        """Run a blocking docker-py call in the executor of the IOLoop, so that the hub is not blocked while waiting for the Docker daemon.
+
+        Returns:
+            Future: resolves to the result of the call
+        """
+
+        return IOLoop.current().run_in_executor(None, partial(method, *args, **kwargs))
+
+    def is_hub_connected(self, network):
+        """Check via the attributes of the (already inspected) network whether the hub container is connected to it.
+        Newly created networks have no containers yet.
+
+        Args:
+            network (docker.Network)
+
+        Returns:
+            bool: True if the hub is listed as container of the network, False otherwise
+        """
+
+        containers = network.attrs.get("Containers") or {}
+        return any(container.get("Name", "").lower() == self.hub_name.lower() for container in containers.values())
+
     def connect_hub_to_network(self, network):
         try:
             network.connect(self.hub_name)
@@ -2,6 +2,8 @@
 Functions to provide Jupyterhub Options forms for our custom spawners.
 """
 
+from functools import lru_cache
+
 label_style = "width: 25%"
 input_style = "width: 75%"
 div_style = "margin-bottom: 16px"
@@ -12,15 +14,21 @@ def get_options_form(spawner, additional_cpu_info="", additional_memory_info="",
     """Return the spawner options screen"""
 
     # Only show spawner options for named servers (the default server should start with default values)
-    if getattr(spawner, "name", "") == "":
+    if not spawner.name:
         return ''
 
+    return render_options_form(tuple(spawner.workspace_images), additional_cpu_info, additional_memory_info)
+
+@lru_cache(maxsize=None)
+def render_options_form(workspace_images, additional_cpu_info, additional_memory_info) -> str:
+    """Render the options form HTML. The form only depends on the configured workspace images and the host information,
+    so it is rendered once and then served from the cache for all spawners.
+    """
+
     description_memory_limit = 'Memory Limit in GB.'
     description_env = 'One name=value pair per line, without quotes'
     description_days_to_live = 'Number of days the container should live'
 
-    default_image = getattr(spawner, "image", "mltooling/ml-workspace:latest")
-
     # Show / hide custom image input field when checkbox is clicked
     custom_image_listener = "if(event.target.checked){ $('#image-name').css('display', 'block'); $('.defined-images').css('display', 'none'); }else{ $('#image-name').css('display', 'none'); $('.defined-images').css('display', 'block'); }"
     
@@ -32,7 +40,7 @@ def get_options_form(spawner, additional_cpu_info="", additional_memory_info="",
         <option value="{image}">{image}</option>
     """
     image_options = ""
-    for image in spawner.workspace_images:
+    for image in workspace_images:
         image_options += image_option_template.format(image=image)
 
     images_template = """
@@ -76,7 +84,6 @@ def get_options_form(spawner, additional_cpu_info="", additional_memory_info="",
         label_style=label_style,
         input_style=input_style,
         additional_info_style=additional_info_style,
-        default_image=default_image,
         images_template=images_template,
         custom_image_listener=custom_image_listener,
         optional_label=optional_label,
@@ -89,14 +96,24 @@ def get_options_form(spawner, additional_cpu_info="", additional_memory_info="",
     )
 
 def get_options_form_docker(spawner):
+    resource_information = spawner.resource_information
+    return render_options_form_docker(
+        tuple(spawner.workspace_images),
+        resource_information['cpu_count'],
+        resource_information['memory_count_in_gb'],
+        resource_information['gpu_count']
+    )
+
+@lru_cache(maxsize=None)
+def render_options_form_docker(workspace_images, cpu_count, memory_count_in_gb, gpu_count) -> str:
     description_gpus = 'Leave empty for no GPU, "all" for all GPUs, or a comma-separated list of indices of the GPUs (e.g 0,2).'
     additional_info = {
-        "additional_cpu_info": "Host has {cpu_count} CPUs".format(cpu_count=spawner.resource_information['cpu_count']),
-        "additional_memory_info": "Host has {memory_count_in_gb}GB memory".format(memory_count_in_gb=spawner.resource_information['memory_count_in_gb']),
-        "additional_gpu_info": "<div>Host has {gpu_count} GPUs</div><div>{description_gpus}</div>".format(gpu_count=spawner.resource_information['gpu_count'], description_gpus=description_gpus)
+        "additional_cpu_info": "Host has {cpu_count} CPUs".format(cpu_count=cpu_count),
+        "additional_memory_info": "Host has {memory_count_in_gb}GB memory".format(memory_count_in_gb=memory_count_in_gb),
+        "additional_gpu_info": "<div>Host has {gpu_count} GPUs</div><div>{description_gpus}</div>".format(gpu_count=gpu_count, description_gpus=description_gpus)
     
     }
-    options_form = get_options_form(spawner, **additional_info)
+    options_form = render_options_form(workspace_images, additional_info['additional_cpu_info'], additional_info['additional_memory_info'])
     
 
     # When GPus shall be used, change the default image to the default gpu image (if the user entered a different image, it is not changed), and show an info box
@@ -110,7 +127,7 @@ def get_options_form_docker(spawner):
     )
 
     gpu_disabled = ""
-    if spawner.resource_information['gpu_count'] < 1:
+    if gpu_count < 1:
         gpu_disabled = "disabled"
 
     options_form_docker = \
@@ -157,9 +174,13 @@ def options_from_form(spawner, formdata):
     env_lines = formdata.get('env', [''])
 
     for line in env_lines[0].splitlines():
-        if line:
-            key, value = line.split('=', 1)
-            env[key.strip()] = value.strip()
+        if not line.strip():
+            continue
+
+        key, sep, value = line.partition('=')
+        if not sep:
+            raise ValueError("Invalid environment variable '{}'. Use one NAME=VALUE pair per line.".format(line.strip()))
+        env[key.strip()] = value.strip()
     options['env'] = env
 
     options['gpus'] = formdata.get('gpus', [None])[0]
@@ -6,6 +6,7 @@ import os
 
 import math
 import time
+import inspect
 
 import docker
 from docker.utils import kwargs_from_env
@@ -26,6 +27,10 @@ ENV_NAME_CLEANUP_INTERVAL_SECONDS = "CLEANUP_INTERVAL_SECONDS"
 LABEL_MLHUB_ORIGIN = "mlhub.origin"
 ENV_HUB_NAME = os.getenv("HUB_NAME", "mlhub")
 
+# Maximum number of kept-alive connections of a docker client to the Docker daemon. The spawners share one client and
+# run their Docker calls concurrently in executor threads, so more connections than the docker-py default (10) are reused
+DOCKER_CLIENT_MAX_POOL_SIZE = 64
+
 def get_lifetime_timestamp(labels: dict) -> float:
     return float(labels.get(LABEL_EXPIRATION_TIMESTAMP, '0'))
 
@@ -38,6 +43,9 @@ def init_docker_client(client_kwargs: dict, tls_config: dict) -> docker.DockerCl
     """
 
     kwargs = {"version": "auto"}
+    # max_pool_size is only supported by newer docker-py versions
+    if "max_pool_size" in inspect.signature(docker.APIClient.__init__).parameters:
+        kwargs["max_pool_size"] = DOCKER_CLIENT_MAX_POOL_SIZE
     if tls_config:
         kwargs["tls"] = docker.tls.TLSConfig(**tls_config)
     kwargs.update(kwargs_from_env())